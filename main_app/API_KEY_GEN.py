@@ -1,3 +1,81 @@
-import secrets
-api_key = secrets.token_hex(32)
-print(f"Generated API Key: {api_key}")
\ No newline at end of file
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# API keys are stored (hashed) in the profile service's key database
+PROFILE_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_service')
+sys.path.insert(0, PROFILE_SERVICE_DIR)
+from api_keys import DEFAULT_BURST, DEFAULT_DB_PATH, DEFAULT_RATE, ApiKeyStore  # noqa: E402
+
+# Usage:
+#   python API_KEY_GEN.py issue MainApp [--rate 50 --burst 100]
+#   python API_KEY_GEN.py rotate <key_id> [--grace-hours 24]
+#   python API_KEY_GEN.py revoke <key_id>
+#   python API_KEY_GEN.py list
+
+
+def format_time(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M') if ts else '-'
+
+
+def positive_number(kind):
+    def parse(value):
+        number = kind(value)
+        if not number > 0:
+            raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+        return number
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage profile service API keys")
+    parser.add_argument('--db', default=os.environ.get('API_KEY_DB_PATH', DEFAULT_DB_PATH),
+                        help="API key database used by the profile service")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    issue = commands.add_parser('issue', help="Create a new key")
+    issue.add_argument('name', help="Client name, e.g. MainApp")
+    issue.add_argument('--rate', type=positive_number(float), default=DEFAULT_RATE, help="Requests per second")
+    issue.add_argument('--burst', type=positive_number(int), default=DEFAULT_BURST, help="Requests allowed in a burst")
+
+    rotate = commands.add_parser('rotate', help="Replace a key; the old one keeps working for a grace period")
+    rotate.add_argument('key_id')
+    rotate.add_argument('--grace-hours', type=float, default=24)
+
+    revoke = commands.add_parser('revoke', help="Disable a key immediately")
+    revoke.add_argument('key_id')
+
+    commands.add_parser('list', help="Show all keys (secrets are never shown)")
+
+    args = parser.parse_args(argv)
+    store = ApiKeyStore(args.db)
+
+    if args.command == 'issue':
+        api_key = store.issue(args.name, rate=args.rate, burst=args.burst)
+        print(f"Generated API Key: {api_key}")
+        print("Store it now; only a hash is kept.")
+    elif args.command == 'rotate':
+        api_key = store.rotate(args.key_id, grace_seconds=args.grace_hours * 3600)
+        if api_key is None:
+            print(f"No active key with id {args.key_id}")
+            return 1
+        print(f"Generated API Key: {api_key}")
+        print(f"Key {args.key_id} stops working in {args.grace_hours:g} hours.")
+    elif args.command == 'revoke':
+        if not store.revoke(args.key_id):
+            print(f"No active key with id {args.key_id}")
+            return 1
+        print(f"Revoked key {args.key_id}")
+    elif args.command == 'list':
+        print(f"{'KEY ID':<14}{'NAME':<20}{'RATE':>8}{'BURST':>7}  {'CREATED':<18}{'EXPIRES':<18}REVOKED")
+        for key in store.list_keys():
+            print(f"{key['key_id']:<14}{key['name']:<20}{key['rate']:>8g}{key['burst']:>7}  "
+                  f"{format_time(key['created_at']):<18}{format_time(key['expires_at']):<18}"
+                  f"{format_time(key['revoked_at'])}")
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
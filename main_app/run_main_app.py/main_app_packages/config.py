@@ -0,0 +1,20 @@
+import os
+
+
+class Config:
+    # --- Profile microservice ---
+    PROFILE_SERVICE_URL = os.environ.get('PROFILE_SERVICE_URL', 'http://127.0.0.1:5001')
+    # Public address browsers load pictures from (the service's public host or a CDN).
+    # Empty means PROFILE_SERVICE_URL is internal-only, so pictures are proxied through this app.
+    PROFILE_PICTURE_BASE_URL = os.environ.get('PROFILE_PICTURE_BASE_URL', '')
+    # Issue one with: python main_app/API_KEY_GEN.py issue MainApp
+    PROFILE_SERVICE_API_KEY = os.environ.get('PROFILE_SERVICE_API_KEY', '')
+    # (connect, read) timeouts in seconds
+    PROFILE_SERVICE_TIMEOUT = (
+        float(os.environ.get('PROFILE_SERVICE_CONNECT_TIMEOUT', 2)),
+        float(os.environ.get('PROFILE_SERVICE_READ_TIMEOUT', 5)),
+    )
+    PROFILE_SERVICE_POOL_SIZE = int(os.environ.get('PROFILE_SERVICE_POOL_SIZE', 20))
+    # Cached profiles per worker and how long they are served without revalidating
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 2048))
+    PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 30))
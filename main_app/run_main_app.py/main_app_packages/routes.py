@@ -1,29 +1,109 @@
-import os
-from flask import app, jsonify, request, send_from_directory
-from profile_service.run_profile_service import student_profiles
-from profile_service.run_profile_service import allowed_file
+from flask import (Blueprint, Response, abort, current_app, jsonify, redirect, render_template,
+                   request, session, url_for)
+from profile_service.instrumentation import Instrumentation
+from .services import ProfileServiceError, get_profile_client
 
+main_app_package = Blueprint('main_app_package', __name__)
 
-@app.route('/profile/<student_id>', methods=['GET'])
-def get_profile(student_id):
-    # --- Authentication (Placeholder) ---
-    # if not authenticate_request():
-    #     return jsonify({"error": "Unauthorized"}), 401
+# Request metrics at /metrics and the opt-in profiler, installed on the app that
+# registers this blueprint. Template rendering is timed per template.
+instrumentation = Instrumentation('main_app')
+main_app_package.record_once(lambda state: instrumentation.init_app(state.app))
 
-    profile = student_profiles.get(student_id)
-    if not profile:
-        return jsonify({"error": "Student profile not found"}), 404
-    return jsonify(profile)
+# JSON endpoints guarded by authenticate_request
+API_ENDPOINTS = {'get_profile', 'upload_profile_picture', 'get_upload_job'}
+# Headers passed each way when pictures are proxied from the profile service
+PICTURE_REQUEST_HEADERS = ('Accept', 'If-None-Match', 'If-Modified-Since')
+PICTURE_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding', 'Cache-Control',
+                            'ETag', 'Last-Modified', 'Vary')
 
-@app.route('/profile/<student_id>/picture', methods=['POST'])
-def upload_profile_picture(student_id):
-    # --- Authentication (Placeholder) ---
-    # if not authenticate_request():
-    #     return jsonify({"error": "Unauthorized"}), 401
 
-    if student_id not in student_profiles:
+# --- Helper Functions ---
+def load_profile(student_id):
+    """ Fetch a profile through the cached client; every profile tab shares the cache entry """
+    try:
+        with instrumentation.timed('profile_service'):
+            profile = get_profile_client(current_app).get_profile(student_id)
+    except ProfileServiceError:
+        abort(503)
+    if profile is None:
+        abort(404)
+    return dict(profile, student_id=student_id)
+
+def current_student_id():
+    return session.get('student_id')
+
+
+# --- Authentication ---
+@main_app_package.before_request
+def authenticate_request():
+    """ Browsers call the API with their login session and may only touch their own profile.
+        (The profile service itself is protected by the API key the client sends.) """
+    if (request.endpoint or '').rpartition('.')[2] not in API_ENDPOINTS:
+        return None
+    student_id = current_student_id()
+    if not student_id:
+        return jsonify({"error": "Unauthorized"}), 401
+    requested = (request.view_args or {}).get('student_id')
+    if requested is not None and requested != student_id:
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+
+# --- Profile Pages ---
+@main_app_package.route('/profile')
+def profile_details():
+    student_id = current_student_id()
+    if not student_id:
+        return redirect(url_for('auth_bp.login'))
+    return render_template('profile_details.html', profile_data=load_profile(student_id))
+
+@main_app_package.route('/profile/address')
+def profile_address():
+    student_id = current_student_id()
+    if not student_id:
+        return redirect(url_for('auth_bp.login'))
+    profile = load_profile(student_id)
+    return render_template('profile_address.html', address=profile.get('address') or {})
+
+@main_app_package.route('/profile/contact')
+def profile_email_phone():
+    student_id = current_student_id()
+    if not student_id:
+        return redirect(url_for('auth_bp.login'))
+    profile = load_profile(student_id)
+    contact = {"email": profile.get('email'), "phone": profile.get('phone')}
+    return render_template('profile_email_phone.html', contact=contact)
+
+@main_app_package.route('/profile/passport')
+def profile_passport():
+    student_id = current_student_id()
+    if not student_id:
+        return redirect(url_for('auth_bp.login'))
+    passport_visa = load_profile(student_id).get('passport_visa') or {}
+    visa = {
+        "passport_number": passport_visa.get('passport_number'),
+        "status": passport_visa.get('visa_status'),
+        "expiry_date": passport_visa.get('expiry_date'),
+    }
+    return render_template('profile_passport.html', visa=visa)
+
+
+# --- Profile API (proxied to the profile service) ---
+@main_app_package.route('/api/profile/<student_id>', methods=['GET'])
+def get_profile(student_id):
+    try:
+        with instrumentation.timed('profile_service'):
+            profile = get_profile_client(current_app).get_profile(student_id)
+    except ProfileServiceError:
+        return jsonify({"error": "Profile service unavailable"}), 503
+    if not profile:
         return jsonify({"error": "Student profile not found"}), 404
+    with instrumentation.timed('json_serialize'):
+        return jsonify(profile)
 
+@main_app_package.route('/api/profile/<student_id>/picture', methods=['POST'])
+def upload_profile_picture(student_id):
     # Check if the post request has the file part
     if 'photo' not in request.files:
         return jsonify({"error": "No photo file part"}), 400
@@ -33,27 +113,45 @@ def upload_profile_picture(student_id):
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if file and allowed_file(file.filename):
-        # Create a predictable filename using student_id
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{student_id}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        try:
-            file.save(filepath)
-            # Update the profile data with the new URL
-            profile_pic_url = f"/profile_pics/{filename}" # Relative URL path
-            student_profiles[student_id]['profile_pic_url'] = profile_pic_url
-            return jsonify({"message": "Profile picture updated successfully", "profile_pic_url": profile_pic_url}), 200
-        except Exception as e:
-            # Log the error e in a real app
-            return jsonify({"error": "Could not save file"}), 500
-    else:
-        return jsonify({"error": "File type not allowed"}), 400
-    
-# Needs: from flask import send_from_directory
-# Needs: import os
-@app.route('/profile_pics/<filename>')
+    # The profile service checks the real image type and size, then processes it in the background
+    try:
+        with instrumentation.timed('profile_service_upload'):
+            body, status = get_profile_client(current_app).upload_profile_picture(student_id, file)
+    except ProfileServiceError:
+        return jsonify({"error": "Could not save file"}), 503
+    return jsonify(body), status
+
+@main_app_package.route('/api/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    # Picture uploads finish in the background; the client drops the cached
+    # profile once the job reports success so the new picture URL shows up
+    try:
+        with instrumentation.timed('profile_service'):
+            body, status = get_profile_client(current_app).get_job(job_id)
+    except ProfileServiceError:
+        return jsonify({"error": "Profile service unavailable"}), 503
+    return jsonify(body), status
+
+@main_app_package.route('/profile_pics/<filename>')
 def get_profile_pic(filename):
-    # Serves the uploaded pictures from the configured UPLOAD_FOLDER
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
\ No newline at end of file
+    # Pictures live on the profile service, which serves them with long-lived cache headers.
+    # Send browsers to its public address when there is one (302, so browsers don't pin it);
+    # otherwise stream the picture through, since PROFILE_SERVICE_URL is internal
+    base_url = current_app.config.get('PROFILE_PICTURE_BASE_URL')
+    if base_url:
+        url = f"{base_url.rstrip('/')}/profile_pics/{filename}"
+        if request.query_string:
+            url += '?' + request.query_string.decode()
+        return redirect(url, code=302)
+
+    headers = {name: request.headers[name] for name in PICTURE_REQUEST_HEADERS if name in request.headers}
+    try:
+        with instrumentation.timed('profile_service_picture'):
+            upstream = get_profile_client(current_app).get_picture(filename, request.query_string, headers)
+    except ProfileServiceError:
+        abort(503)
+    response = Response(upstream.raw.stream(64 * 1024, decode_content=False), status=upstream.status_code,
+                        headers={name: upstream.headers[name] for name in PICTURE_RESPONSE_HEADERS
+                                 if name in upstream.headers})
+    response.call_on_close(upstream.close)
+    return response
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- Profile service client ---
+# All profile tabs render from the same profile record, so the main app keeps
+# a small per-process cache in front of the profile microservice:
+#   * one pooled keep-alive session with timeouts and retries on idempotent calls
+#   * a bounded LRU cache with a TTL, keyed by student ID
+#   * concurrent misses for the same student share a single upstream request
+#   * expired entries are revalidated with If-None-Match, so an unchanged
+#     profile costs a 304 instead of a full body
+#   * any successful write through the client invalidates the entry
+
+
+class ProfileServiceError(Exception):
+    """ Raised when the profile service cannot be reached or returns an error """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ProfileCache:
+    """ Thread-safe LRU cache whose entries go stale after `ttl` seconds """
+
+    def __init__(self, max_size=2048, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict() # student_id -> (expires_at, etag, profile)
+        self._lock = threading.Lock()
+
+    def get(self, student_id):
+        """ Returns (profile, etag, fresh) or None """
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(student_id)
+        expires_at, etag, profile = entry
+        return profile, etag, time.monotonic() < expires_at
+
+    def set(self, student_id, profile, etag=None):
+        with self._lock:
+            self._entries[student_id] = (time.monotonic() + self.ttl, etag, profile)
+            self._entries.move_to_end(student_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, student_id):
+        with self._lock:
+            self._entries.pop(student_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _InFlight:
+    """ One upstream fetch that concurrent callers wait on """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ProfileServiceClient:
+    def __init__(self, base_url, api_key=None, timeout=(2, 5), pool_size=20,
+                 cache_size=2048, cache_ttl=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = ProfileCache(cache_size, cache_ttl)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers['X-API-Key'] = api_key
+        retry = Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'HEAD'}))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['PROFILE_SERVICE_URL'],
+                   api_key=config.get('PROFILE_SERVICE_API_KEY'),
+                   timeout=config.get('PROFILE_SERVICE_TIMEOUT', (2, 5)),
+                   pool_size=config.get('PROFILE_SERVICE_POOL_SIZE', 20),
+                   cache_size=config.get('PROFILE_CACHE_SIZE', 2048),
+                   cache_ttl=config.get('PROFILE_CACHE_TTL', 30))
+
+    # --- Reads ---
+    def get_profile(self, student_id):
+        """ Returns the profile dict, or None if the student does not exist """
+        cached = self.cache.get(student_id)
+        if cached and cached[2]:
+            return cached[0]
+
+        with self._inflight_lock:
+            call = self._inflight.get(student_id)
+            leader = call is None
+            if leader:
+                call = self._inflight[student_id] = _InFlight()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._fetch(student_id, cached, call)
+        except Exception as e:
+            # Followers must see the same failure, never a None that reads as "not found"
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(student_id) is call:
+                    del self._inflight[student_id]
+            call.done.set()
+        return call.result
+
+    def _fetch(self, student_id, cached, call):
+        headers = {}
+        if cached and cached[1]:
+            headers['If-None-Match'] = cached[1]
+        try:
+            response = self.session.get(f"{self.base_url}/profile/{student_id}",
+                                        headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProfileServiceError(f"Profile service unavailable: {e}") from e
+
+        if response.status_code == 404:
+            self.cache.invalidate(student_id)
+            return None
+        if response.status_code == 304:
+            profile, etag = cached[0], cached[1]
+        elif response.ok:
+            try:
+                profile, etag = response.json(), response.headers.get('ETag')
+            except ValueError as e:
+                raise ProfileServiceError("Invalid response from profile service", response.status_code) from e
+        else:
+            raise ProfileServiceError("Profile service error", response.status_code)
+
+        # Skip caching if a write invalidated this student while we were fetching
+        with self._inflight_lock:
+            if self._inflight.get(student_id) is call:
+                self.cache.set(student_id, profile, etag)
+        return profile
+
+    # --- Writes ---
+    def upload_profile_picture(self, student_id, file):
+        """ Forwards an uploaded FileStorage to the profile service; returns (json, status) """
+        files = {'photo': (file.filename, file.stream, file.mimetype)}
+        try:
+            response = self.session.post(f"{self.base_url}/profile/{student_id}/picture",
+                                         files=files, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProfileServiceError(f"Profile service unavailable: {e}") from e
+        if response.ok:
+            self.invalidate(student_id)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"error": "Invalid response from profile service"}
+        return body, response.status_code
+
+    def get_job(self, job_id):
+        """ Status of a background picture job; returns (json, status) """
+        try:
+            response = self.session.get(f"{self.base_url}/jobs/{job_id}", timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProfileServiceError(f"Profile service unavailable: {e}") from e
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"error": "Invalid response from profile service"}
+        # The new picture URL is only written to the profile when the job succeeds
+        if response.ok and body.get('status') == 'succeeded' and body.get('student_id'):
+            self.invalidate(body['student_id'])
+        return body, response.status_code
+
+    def get_picture(self, filename, query_string=b'', headers=None):
+        """ Streamed picture response from the profile service; the caller must close it """
+        url = f"{self.base_url}/profile_pics/{filename}"
+        if query_string:
+            url += '?' + query_string.decode()
+        try:
+            return self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        except requests.RequestException as e:
+            raise ProfileServiceError(f"Profile service unavailable: {e}") from e
+
+    def invalidate(self, student_id):
+        """ Drop the cached profile and detach any in-flight fetch from the cache """
+        with self._inflight_lock:
+            self._inflight.pop(student_id, None)
+            self.cache.invalidate(student_id)
+
+    def close(self):
+        self.session.close()
+
+
+_client_lock = threading.Lock()
+
+def get_profile_client(app):
+    """ One shared client (and cache) per Flask app and process """
+    client = app.extensions.get('profile_client')
+    if client is None:
+        with _client_lock:
+            client = app.extensions.get('profile_client')
+            if client is None:
+                client = app.extensions['profile_client'] = ProfileServiceClient.from_config(app.config)
+    return client
@@ -0,0 +1,206 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from profile_store import SQLitePool
+
+# --- API key store and rate limiter ---
+# Keys look like "<key_id>.<secret>". Only a salted HMAC-SHA256 of the secret
+# is stored; key_id is the lookup index. Secrets are 256 random bits, so a
+# fast hash is enough and a wrong key costs no more than a right one (keys
+# issued by older builds use PBKDF2 and are re-hashed on their first use).
+# Each worker remembers verified keys by SHA-256 of the key, never the key
+# itself, and re-reads the key's row every VERIFIED_CACHE_TTL seconds, so
+# revocations and rotations take effect within that window.
+#
+# Rate limits are token buckets kept in the same SQLite file, so every worker
+# process draws from the same bucket. To keep SQLite writes off most requests,
+# a worker takes up to RESERVE_SECONDS worth of tokens in one transaction and
+# spends them locally; unused reserved tokens lapse after RESERVE_SECONDS.
+# An empty bucket is also remembered locally until its next token is due, so
+# rejected callers don't cost a write either.
+
+# Shared default for the service and API_KEY_GEN.py, independent of either one's cwd
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_keys.db')
+VERIFIED_CACHE_TTL = 60
+DEFAULT_RATE = 50.0   # Tokens added per second
+DEFAULT_BURST = 100   # Bucket size
+RESERVE_SECONDS = 0.2
+MAX_RESERVE = 100
+
+
+class ApiKeyStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS api_keys (
+            key_id     TEXT PRIMARY KEY,
+            name       TEXT NOT NULL,
+            salt       BLOB NOT NULL,
+            hash       BLOB NOT NULL,
+            iterations INTEGER NOT NULL,
+            rate       REAL NOT NULL,
+            burst      INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL,
+            revoked_at REAL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            key_id     TEXT PRIMARY KEY,
+            tokens     REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=3):
+        self._db = SQLitePool(path, pool_size)
+        self._verified = {} # sha256(presented key) -> (key info, cached_at)
+        self._reserved = {} # key_id -> (local tokens, usable until, bucket empty until)
+        self._lock = threading.Lock()
+        with self._db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _hash(secret, salt, iterations=0):
+        if iterations: # Legacy PBKDF2 row
+            return hashlib.pbkdf2_hmac('sha256', secret.encode(), salt, iterations)
+        return hmac.digest(salt, secret.encode(), 'sha256')
+
+    # --- Key management (used by API_KEY_GEN.py) ---
+    def issue(self, name, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """ Create a key and return it. The full key is only ever available here. """
+        if not rate > 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        key_id, secret = secrets.token_hex(6), secrets.token_urlsafe(32)
+        salt = secrets.token_bytes(16)
+        with self._db.transaction() as conn:
+            conn.execute("INSERT INTO api_keys (key_id, name, salt, hash, iterations, rate, burst, "
+                         "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (key_id, name, salt, self._hash(secret, salt), 0, rate, burst, time.time()))
+        return f"{key_id}.{secret}"
+
+    def rotate(self, key_id, grace_seconds=86400):
+        """ Issue a replacement with the same name and limits; the old key expires after the grace period """
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT name, rate, burst FROM api_keys WHERE key_id = ? AND revoked_at IS NULL",
+                               (key_id,)).fetchone()
+        if row is None:
+            return None
+        new_key = self.issue(*row)
+        with self._db.transaction() as conn:
+            conn.execute("UPDATE api_keys SET expires_at = ? WHERE key_id = ?",
+                         (time.time() + grace_seconds, key_id))
+        return new_key
+
+    def revoke(self, key_id):
+        with self._db.transaction() as conn:
+            cursor = conn.execute("UPDATE api_keys SET revoked_at = ? WHERE key_id = ? AND revoked_at IS NULL",
+                                  (time.time(), key_id))
+        return cursor.rowcount > 0
+
+    def list_keys(self):
+        with self._db.connection() as conn:
+            rows = conn.execute("SELECT key_id, name, rate, burst, created_at, expires_at, revoked_at "
+                                "FROM api_keys ORDER BY created_at").fetchall()
+        columns = ('key_id', 'name', 'rate', 'burst', 'created_at', 'expires_at', 'revoked_at')
+        return [dict(zip(columns, row)) for row in rows]
+
+    # --- Request path ---
+    def verify(self, presented):
+        """ Returns {'key_id', 'name', 'rate', 'burst'} for a valid key, else None """
+        if not presented or '.' not in presented:
+            return None
+        cache_key = hashlib.sha256(presented.encode()).digest()
+        cached = self._verified.get(cache_key)
+        if cached is None:
+            info = self._check_secret(presented)
+            if info is None:
+                return None
+            cached = (info, time.time())
+            with self._lock:
+                self._verified[cache_key] = cached
+        info, checked_at = cached
+        now = time.time()
+        if info is not None and now - checked_at >= VERIFIED_CACHE_TTL:
+            # The secret was already checked; only re-read revocation, expiry and limits
+            info = self._lookup(info['key_id'])
+            with self._lock:
+                if info is None:
+                    self._verified.pop(cache_key, None)
+                else:
+                    self._verified[cache_key] = (info, now)
+        if info is None or (info['expires_at'] is not None and now >= info['expires_at']):
+            return None
+        return info
+
+    def _lookup(self, key_id):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT name, rate, burst, expires_at FROM api_keys "
+                               "WHERE key_id = ? AND revoked_at IS NULL", (key_id,)).fetchone()
+        if row is None:
+            return None
+        name, rate, burst, expires_at = row
+        return {'key_id': key_id, 'name': name, 'rate': rate, 'burst': burst, 'expires_at': expires_at}
+
+    def _check_secret(self, presented):
+        """ Compare the secret against the stored hash; returns key info or None """
+        key_id, secret = presented.split('.', 1)
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT salt, hash, iterations FROM api_keys "
+                               "WHERE key_id = ? AND revoked_at IS NULL", (key_id,)).fetchone()
+        if row is None:
+            return None
+        salt, stored_hash, iterations = row
+        if not hmac.compare_digest(self._hash(secret, salt, iterations), stored_hash):
+            return None
+        if iterations:
+            with self._db.transaction() as conn:
+                conn.execute("UPDATE api_keys SET hash = ?, iterations = 0 WHERE key_id = ?",
+                             (self._hash(secret, salt), key_id))
+        return self._lookup(key_id)
+
+    def allow(self, info):
+        """ Take one token from the key's shared bucket; False when the caller should back off """
+        key_id = info['key_id']
+        now = time.monotonic()
+        with self._lock:
+            tokens, usable_until, empty_until = self._reserved.get(key_id, (0, 0, 0))
+            if tokens >= 1 and now < usable_until:
+                self._reserved[key_id] = (tokens - 1, usable_until, 0)
+                return True
+            if now < empty_until:
+                return False
+
+        wanted = max(1, min(MAX_RESERVE, int(info['rate'] * RESERVE_SECONDS)))
+        taken, wait = self._take(info, wanted)
+        with self._lock:
+            now = time.monotonic()
+            if taken == 0:
+                self._reserved[key_id] = (0, 0, now + wait)
+                return False
+            tokens, usable_until, _ = self._reserved.get(key_id, (0, 0, 0))
+            if now >= usable_until:
+                tokens = 0
+            self._reserved[key_id] = (tokens + taken - 1, now + RESERVE_SECONDS, 0)
+        return True
+
+    def _take(self, info, wanted):
+        """ Refill the shared bucket by elapsed time and take up to `wanted` whole tokens.
+            Returns (tokens taken, seconds until the next token if none were available). """
+        rate, burst = info['rate'], info['burst']
+        with self._db.transaction() as conn:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key_id = ?",
+                               (info['key_id'],)).fetchone()
+            available = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            taken = int(min(wanted, available))
+            if taken == 0:
+                return 0, (1 - available) / rate if rate > 0 else 60
+            conn.execute("INSERT INTO rate_buckets (key_id, tokens, updated_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT(key_id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                         (info['key_id'], available - taken, now))
+        return taken, 0
+
+    def close(self):
+        self._db.close()
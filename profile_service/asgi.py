@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+
+from a2wsgi import WSGIMiddleware
+
+import run_profile_service as service
+
+logger = logging.getLogger(__name__)
+
+# --- ASGI entry point ---
+# uvicorn's event loop accepts connections and parses HTTP, so idle keep-alive
+# connections cost no thread. Past that, this is a threaded WSGI server: a2wsgi
+# runs each request's Flask view on a pool of WEB_THREADS threads per process,
+# and the thread stays with the request until the response is finished. That
+# includes reading the request body (a slow upload holds a thread for its whole
+# duration) and sending picture files. Store and file I/O is ordinary blocking
+# I/O on those threads. Size WEB_THREADS for concurrent slow uploads plus
+# normal traffic.
+#
+# Note: asgiref's WsgiToAsgi is not used here; it runs every request on one
+# shared thread.
+#
+# Shutdown on SIGTERM:
+#   1. /readyz answers 503 at once; requests keep being served for DRAIN_SECONDS
+#      so load balancers can take this process out of rotation
+#   2. uvicorn stops accepting connections and waits up to GRACEFUL_TIMEOUT
+#      for in-flight requests
+#   3. lifespan shutdown waits up to GRACEFUL_TIMEOUT more for the request thread
+#      pool, then stops the picture workers and closes the databases
+
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 32))
+SHUTDOWN_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', 30))
+DRAIN_SECONDS = float(os.environ.get('DRAIN_SECONDS', 5))
+
+
+class ProfileServiceASGI:
+    def __init__(self, wsgi_app, threads):
+        self.http = WSGIMiddleware(wsgi_app, workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        else:
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.to_thread(service.startup)
+                self.install_drain_handlers(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                service.service_ready.clear()
+                # Requests that outlived the graceful timeout still run on the pool; give them
+                # one more timeout to finish before the stores they use are closed
+                # (waited on from a daemon thread: asyncio.run joins its own executor at exit)
+                waiter = threading.Thread(target=self.http.executor.shutdown, daemon=True)
+                waiter.start()
+                await asyncio.to_thread(waiter.join, SHUTDOWN_TIMEOUT)
+                if waiter.is_alive():
+                    logger.warning("Request threads still busy after %ss; shutting down anyway",
+                                   SHUTDOWN_TIMEOUT)
+                await asyncio.to_thread(service.shutdown, SHUTDOWN_TIMEOUT)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def install_drain_handlers(loop):
+        """ Wrap uvicorn's exit handlers: mark the process not ready as soon as the signal
+            arrives, and pass SIGTERM on only after DRAIN_SECONDS (SIGINT right away) """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            server_handler = signal.getsignal(sig)
+            if not callable(server_handler):
+                continue
+
+            def handle(signum, frame, server_handler=server_handler):
+                service.service_ready.clear()
+                delay = DRAIN_SECONDS if signum == signal.SIGTERM else 0
+                loop.call_soon_threadsafe(loop.call_later, delay, server_handler, signum, frame)
+            signal.signal(sig, handle)
+
+
+application = ProfileServiceASGI(service.app, WEB_THREADS)
@@ -0,0 +1,358 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+from PIL import Image
+
+from synthetic import SERVICE_DIR, ensure_dataset, parse_scale, student_id
+
+from api_keys import ApiKeyStore  # noqa: E402  (path set up by synthetic)
+
+# --- Load test for the profile API ---
+# Launches the profile service against a synthetic data set, replays a mixed
+# workload from many client threads, and reports throughput and latency
+# percentiles per operation. Results are saved as JSON; --compare checks a
+# run against an earlier one and exits non-zero on a regression.
+#
+#   python load_test.py --scale 100k --duration 30 --concurrency 64
+#   python load_test.py --scale 100k --compare results/baseline.json
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_MIX = 'get=50,get_conditional=20,picture=20,batch=8,upload=2'
+BATCH_SIZE = 100
+BATCH_FIELDS = 'first_name,last_name,program,profile_pic_url'
+PICTURE_STUDENTS = 20
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def png_bytes(seed):
+    img = Image.new('RGB', (800, 600), (seed % 256, (seed // 256) % 256, 128))
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class ServiceProcess:
+    """ The profile service running in a subprocess with its own scratch directory """
+
+    def __init__(self, db_path, server='serve', workers=None, threads=None):
+        self.workdir = tempfile.mkdtemp(prefix='profile-bench-')
+        # Work on a copy so uploads don't change the shared data set between runs
+        run_db = os.path.join(self.workdir, 'profiles.db')
+        shutil.copyfile(db_path, run_db)
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        key_db = os.path.join(self.workdir, 'api_keys.db')
+        keys = ApiKeyStore(key_db)
+        # Effectively unlimited, so the benchmark measures the service rather than the limiter
+        self.api_key = keys.issue('Benchmark', rate=1e9, burst=10**9)
+        keys.close()
+
+        env = dict(os.environ, PROFILE_STORE_URL=f"sqlite:///{run_db}", API_KEY_DB_PATH=key_db,
+                   JOB_QUEUE_PATH=os.path.join(self.workdir, 'jobs.db'), PORT=str(self.port),
+                   PYTHONPATH=SERVICE_DIR)
+        if workers:
+            env['WEB_WORKERS'] = str(workers)
+        if threads:
+            env['WEB_THREADS'] = str(threads)
+        if server == 'serve':
+            cmd = [sys.executable, os.path.join(SERVICE_DIR, 'serve.py')]
+        else:
+            # Flask development server, for comparison
+            cmd = [sys.executable, '-c', f"import run_profile_service as s; s.startup(); s.app.run(port={self.port}, threaded=True)"]
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.proc = subprocess.Popen(cmd, cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Service exited early; see {self.log.name}")
+            try:
+                if requests.get(f"{self.url}/readyz", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("Service did not become ready")
+
+    def stop(self, keep=False):
+        self.proc.terminate()
+        try:
+            self.proc.wait(30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+        if not keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class Workload:
+    """ Per-thread request generator; each op returns (status_code, bytes received) """
+
+    def __init__(self, url, api_key, population, picture_urls, seed):
+        self.url = url
+        self.rng = random.Random(seed)
+        self.population = population
+        self.picture_urls = picture_urls
+        self.session = requests.Session()
+        self.session.headers['X-API-Key'] = api_key
+        self.etags = {}
+        self.upload_counter = seed * 1_000_000
+
+    def random_id(self):
+        return student_id(self.rng.randrange(self.population))
+
+    def get(self):
+        r = self.session.get(f"{self.url}/profile/{self.random_id()}")
+        return r.status_code, len(r.content)
+
+    def get_conditional(self):
+        # Dashboard polling: re-request a profile we've already seen
+        if not self.etags:
+            sid = self.random_id()
+            r = self.session.get(f"{self.url}/profile/{sid}")
+        else:
+            sid = self.rng.choice(list(self.etags))
+            r = self.session.get(f"{self.url}/profile/{sid}", headers={'If-None-Match': self.etags[sid]})
+        if r.headers.get('ETag'):
+            self.etags[sid] = r.headers['ETag']
+            if len(self.etags) > 200:
+                self.etags.pop(next(iter(self.etags)))
+        return r.status_code, len(r.content)
+
+    def picture(self):
+        if not self.picture_urls:
+            return self.get()
+        size = self.rng.choice(['64', '256', '512'])
+        accept = self.rng.choice(['image/webp,*/*', 'image/jpeg'])
+        r = self.session.get(f"{self.url}{self.rng.choice(self.picture_urls)}?size={size}",
+                             headers={'Accept': accept})
+        return r.status_code, len(r.content)
+
+    def batch(self):
+        ids = [self.random_id() for _ in range(BATCH_SIZE)]
+        r = self.session.post(f"{self.url}/profiles:batch?fields={BATCH_FIELDS}", json={'ids': ids})
+        return r.status_code, len(r.content)
+
+    def upload(self):
+        self.upload_counter += 1
+        files = {'photo': ('photo.png', png_bytes(self.upload_counter), 'image/png')}
+        # Leave the students used by picture GETs alone so their files stay in place
+        sid = student_id(self.rng.randrange(min(PICTURE_STUDENTS, self.population - 1), self.population))
+        r = self.session.post(f"{self.url}/profile/{sid}/picture", files=files)
+        return r.status_code, len(r.content)
+
+
+def prepare_pictures(url, api_key, population):
+    """ Upload a few pictures up front so picture GETs hit real files """
+    session = requests.Session()
+    session.headers['X-API-Key'] = api_key
+    jobs = []
+    for i in range(min(PICTURE_STUDENTS, population)):
+        files = {'photo': ('photo.png', png_bytes(i), 'image/png')}
+        r = session.post(f"{url}/profile/{student_id(i)}/picture", files=files)
+        if r.status_code == 202:
+            jobs.append(r.json()['job_id'])
+    urls = []
+    deadline = time.time() + 60
+    for job_id in jobs:
+        while time.time() < deadline:
+            job = session.get(f"{url}/jobs/{job_id}").json()
+            if job['status'] == 'succeeded':
+                urls.append(job['result']['profile_pic_url'])
+                break
+            if job['status'] == 'failed':
+                break
+            time.sleep(0.1)
+    return urls
+
+
+def run_load(url, api_key, population, mix, duration, concurrency, picture_urls):
+    ops, weights = zip(*mix.items())
+    samples = {op: [] for op in ops}
+    errors = {op: 0 for op in ops}
+    received = {op: 0 for op in ops}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def client(seed):
+        workload = Workload(url, api_key, population, picture_urls, seed)
+        rng = random.Random(seed)
+        local = {op: [] for op in ops}
+        local_errors = {op: 0 for op in ops}
+        local_bytes = {op: 0 for op in ops}
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            op = rng.choices(ops, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status, size = getattr(workload, op)()
+            except requests.RequestException:
+                status, size = 599, 0
+            local[op].append(time.perf_counter() - t0)
+            local_bytes[op] += size
+            if status >= 400:
+                local_errors[op] += 1
+        with lock:
+            for op in ops:
+                samples[op].extend(local[op])
+                errors[op] += local_errors[op]
+                received[op] += local_bytes[op]
+
+    threads = [threading.Thread(target=client, args=(i + 1,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    deadline[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    def summarize(latencies, error_count, byte_count):
+        latencies = sorted(latencies)
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        return {
+            "requests": len(latencies),
+            "errors": error_count,
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "bytes_received": byte_count,
+            "p50_ms": ms(percentile(latencies, 50)),
+            "p95_ms": ms(percentile(latencies, 95)),
+            "p99_ms": ms(percentile(latencies, 99)),
+            "max_ms": ms(latencies[-1] if latencies else None),
+        }
+
+    results = {op: summarize(samples[op], errors[op], received[op]) for op in ops}
+    results['all'] = summarize([v for op in ops for v in samples[op]],
+                               sum(errors.values()), sum(received.values()))
+    return results, elapsed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVICE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """ Print per-op changes; returns the list of regressions beyond `threshold` (e.g. 0.1 = 10%) """
+    regressions = []
+    print(f"\n{'OP':<18}{'RPS':>10}{'Δ':>8}{'P99 MS':>10}{'Δ':>8}")
+    for op, now in current['results'].items():
+        before = baseline['results'].get(op)
+        if not before or not before['requests'] or not now['requests']:
+            continue
+        rps_change = now['throughput_rps'] / before['throughput_rps'] - 1
+        p99_change = now['p99_ms'] / before['p99_ms'] - 1 if before['p99_ms'] else 0
+        print(f"{op:<18}{now['throughput_rps']:>10}{rps_change:>+8.0%}{now['p99_ms']:>10}{p99_change:>+8.0%}")
+        if rps_change < -threshold:
+            regressions.append(f"{op}: throughput {rps_change:+.0%}")
+        if p99_change > threshold:
+            regressions.append(f"{op}: p99 {p99_change:+.0%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the profile service")
+    parser.add_argument('--scale', default='1k', help="1k, 100k, 1m or a number of students")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load")
+    parser.add_argument('--concurrency', type=int, default=32, help="Client threads")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument('--server', choices=('serve', 'dev'), default='serve',
+                        help="serve.py (production) or the Flask development server")
+    parser.add_argument('--workers', type=int, help="WEB_WORKERS for serve.py")
+    parser.add_argument('--threads', type=int, help="WEB_THREADS for serve.py")
+    parser.add_argument('--output', help="Result file (default results/<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier result file to check for regressions")
+    parser.add_argument('--keep', action='store_true', help="Keep the service's scratch directory and log")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed regression (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    population = parse_scale(args.scale)
+    mix = parse_mix(args.mix)
+    print(f"Preparing {population} synthetic profiles...")
+    db_path = ensure_dataset(population)
+
+    service = ServiceProcess(db_path, args.server, args.workers, args.threads)
+    try:
+        service.wait_ready()
+        picture_urls = prepare_pictures(service.url, service.api_key, population) if 'picture' in mix else []
+        print(f"Running {args.duration:g}s at concurrency {args.concurrency} against {service.url}...")
+        results, elapsed = run_load(service.url, service.api_key, population, mix,
+                                    args.duration, args.concurrency, picture_urls)
+    finally:
+        service.stop(keep=args.keep)
+        if args.keep:
+            print(f"Service files kept in {service.workdir}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "git_revision": git_revision(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count()},
+        "config": {"scale": population, "duration": args.duration, "elapsed": round(elapsed, 2),
+                   "concurrency": args.concurrency, "mix": mix, "server": args.server,
+                   "workers": args.workers, "threads": args.threads},
+        "results": results,
+    }
+
+    print(f"\n{'OP':<18}{'REQS':>8}{'ERR':>6}{'RPS':>10}{'P50 MS':>10}{'P95 MS':>10}{'P99 MS':>10}")
+    for op, r in results.items():
+        print(f"{op:<18}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']:>10}"
+              f"{str(r['p50_ms']):>10}{str(r['p95_ms']):>10}{str(r['p99_ms']):>10}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_{population}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+from synthetic import ensure_dataset, parse_scale, student_id
+
+from profile_store import MemoryProfileStore, SQLiteProfileStore  # noqa: E402
+
+# --- Microbenchmarks for the get_profile path ---
+# Times each step of serving GET /profile/<id> in isolation: the store lookups
+# (version check, full record, plain get), JSON decode of the stored row, the
+# response serialization, and the whole view through Flask's test client.
+#
+#   python microbench.py --scale 100k
+#   python microbench.py --scale 100k --output results/micro.json
+
+def measure(name, func, number, repeat=5):
+    """ Best of `repeat` runs, reported as microseconds per call and calls per second """
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    result = {"name": name, "us_per_op": round(best * 1e6, 2), "ops_per_sec": round(1 / best)}
+    print(f"{name:<36}{result['us_per_op']:>12.2f} us{result['ops_per_sec']:>14,} ops/s")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark profile lookups and serialization")
+    parser.add_argument('--scale', default='100k', help="1k, 100k, 1m or a number of students")
+    parser.add_argument('--number', type=int, default=2000, help="Calls per timing run")
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    population = parse_scale(args.scale)
+    db_path = ensure_dataset(population)
+    rng = random.Random(1)
+    ids = [student_id(rng.randrange(population)) for _ in range(4096)]
+    next_id = itertools.cycle(ids).__next__
+
+    store = SQLiteProfileStore(db_path)
+    memory = MemoryProfileStore()
+    memory.bulk_import((sid, store.get(sid)) for sid in set(ids))
+    sample = store.get(ids[0])
+    raw = json.dumps(sample, separators=(',', ':'))
+
+    print(f"{population:,} profiles, {args.number} calls per run\n")
+    results = [
+        measure("sqlite get_version", lambda: store.get_version(next_id()), args.number),
+        measure("sqlite get_record", lambda: store.get_record(next_id()), args.number),
+        measure("sqlite get", lambda: store.get(next_id()), args.number),
+        measure("sqlite exists", lambda: store.exists(next_id()), args.number),
+        measure("sqlite get_many (100 ids)", lambda: store.get_many([next_id() for _ in range(100)]),
+                max(args.number // 100, 10)),
+        measure("memory get_record", lambda: memory.get_record(next_id()), args.number),
+        measure("json.loads (stored row)", lambda: json.loads(raw), args.number),
+        measure("json.dumps (compact)", lambda: json.dumps(sample, separators=(',', ':')), args.number),
+    ]
+
+    # The service reads its settings at import time; point it at a scratch copy
+    workdir = tempfile.mkdtemp(prefix='profile-micro-')
+    shutil.copyfile(db_path, os.path.join(workdir, 'profiles.db'))
+    os.environ.update(PROFILE_STORE_URL=f"sqlite:///{os.path.join(workdir, 'profiles.db')}",
+                      JOB_QUEUE_PATH=os.path.join(workdir, 'jobs.db'),
+                      API_KEY_DB_PATH=os.path.join(workdir, 'api_keys.db'),
+                      UPLOAD_FOLDER=os.path.join(workdir, 'profile_pics'),
+                      INCOMING_FOLDER=os.path.join(workdir, 'incoming_pics'),
+                      PICTURE_WORKER_THREADS='0', REQUIRE_API_KEY='0')
+    import run_profile_service as service
+    client = service.app.test_client()
+    with service.app.app_context():
+        results.append(measure("flask jsonify", lambda: service.jsonify(sample), args.number))
+    etag_for = {}
+    for sid in set(ids):
+        version = service.profile_store.get_version(sid)
+        etag_for[sid] = f'"{service.profile_etag(*version)}"'
+    results.append(measure("GET /profile/<id> (200)", lambda: client.get(f"/profile/{next_id()}"),
+                           args.number // 4))
+
+    def conditional_get():
+        sid = next_id()
+        return client.get(f"/profile/{sid}", headers={'If-None-Match': etag_for[sid]})
+    results.append(measure("GET /profile/<id> (304)", conditional_get, args.number // 4))
+    service.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    store.close()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({"timestamp": datetime.now().isoformat(timespec='seconds'),
+                       "scale": population, "number": args.number, "results": results}, f, indent=2)
+        print(f"\nSaved {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import os
+import random
+import sqlite3
+import sys
+
+# Benchmarks import the service modules directly
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from profile_store import SQLiteProfileStore  # noqa: E402
+
+# --- Synthetic student profiles ---
+# Same shape as the s12345678 sample record in run_profile_service.py.
+# Generation is seeded, so a given scale always produces the same data set.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+FIRST_NAMES = ['Jane', 'John', 'Mere', 'Sione', 'Ana', 'Ravi', 'Priya', 'Tevita', 'Losa', 'Kiri',
+               'Mele', 'Josefa', 'Akosita', 'Arjun', 'Salote', 'Viliami']
+LAST_NAMES = ['Doe', 'Naidu', 'Tuilagi', 'Prasad', 'Fifita', 'Kumar', 'Vakacegu', 'Taufa',
+              'Singh', 'Ratu', 'Lal', 'Havili']
+PROGRAMS = ['Bachelor of Science', 'Bachelor of Arts', 'Bachelor of Commerce',
+            'Bachelor of Engineering', 'Master of Science', 'Diploma in Education']
+CAMPUSES = ['Laucala Campus, Suva, Fiji', 'Emalus Campus, Port Vila, Vanuatu',
+            'Alafua Campus, Apia, Samoa', 'Tonga Campus, Nuku\'alofa, Tonga']
+CITIZENSHIPS = ['Fijian', 'Samoan', 'Tongan', 'Ni-Vanuatu', 'Solomon Islander']
+CITIES = [('Suva', 'Central', 'Fiji'), ('Lautoka', 'Western', 'Fiji'), ('Apia', 'Upolu', 'Samoa'),
+          ('Port Vila', 'Shefa', 'Vanuatu'), ('Nuku\'alofa', 'Tongatapu', 'Tonga')]
+
+
+def parse_scale(value):
+    """ '1k' / '100k' / '1m' or a plain number """
+    return SCALES.get(str(value).lower()) or int(value)
+
+
+def student_id(i):
+    return f"s{10000000 + i:08d}"
+
+
+def make_profile(i, rng):
+    sid = student_id(i)
+    city, state, country = rng.choice(CITIES)
+    return {
+        "first_name": rng.choice(FIRST_NAMES),
+        "middle_name": rng.choice(['', '', rng.choice(FIRST_NAMES)]),
+        "last_name": rng.choice(LAST_NAMES),
+        "dob": f"{rng.randint(1995, 2007)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "gender": rng.choice(['Female', 'Male']),
+        "citizenship": rng.choice(CITIZENSHIPS),
+        "program": rng.choice(PROGRAMS),
+        "student_level": rng.choice(['Undergraduate', 'Undergraduate', 'Postgraduate']),
+        "student_campus": rng.choice(CAMPUSES),
+        "email": f"{sid}@student.usp.ac.fj",
+        "phone": f"+679 {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+        "address": {
+            "street": f"{rng.randint(1, 999)} University Way", "city": city, "state": state,
+            "country": country, "postal_code": f"{rng.randint(0, 9999):04d}"
+        },
+        "passport_visa": {
+            "passport_number": f"P{rng.randint(100000, 999999)}", "visa_status": "Student Visa",
+            "expiry_date": f"{rng.randint(2026, 2031)}-12-31"
+        },
+        "profile_pic_url": None
+    }
+
+
+def generate_profiles(count, seed=415):
+    """ Yield (student_id, profile) pairs """
+    rng = random.Random(seed)
+    for i in range(count):
+        yield student_id(i), make_profile(i, rng)
+
+
+def dataset_path(count):
+    return os.path.join(DATA_DIR, f"profiles_{count}.db")
+
+
+def ensure_dataset(count):
+    """ Build (once) and return a SQLite profile database with `count` synthetic students """
+    path = dataset_path(count)
+    if os.path.exists(path):
+        with sqlite3.connect(path) as conn:
+            if conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0] >= count:
+                return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    store = SQLiteProfileStore(path)
+    store.bulk_import(generate_profiles(count))
+    store.close()
+    return path
+
+
+# python synthetic.py 100k   -> builds benchmarks/data/profiles_100000.db
+if __name__ == '__main__':
+    for arg in sys.argv[1:] or ['1k']:
+        print(ensure_dataset(parse_scale(arg)))
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import secrets
+
+from PIL import Image, ImageOps
+
+# --- Profile picture processing ---
+# Uploads are copied to disk in chunks with a hard size cap, identified by
+# their magic bytes (not the client's file extension), then re-encoded into a
+# fixed set of square variants. Re-encoding drops EXIF and any other metadata.
+#
+# Files for one upload share a content-hashed stem:
+#   <student_id>-<hash>-<size>.webp / <student_id>-<hash>-<size>.jpg
+
+VARIANT_SIZES = (64, 256, 512)
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+CHUNK_SIZE = 64 * 1024
+# Refuse images that would decode to more pixels than this (decompression bombs).
+# Pillow only raises on its own above twice its limit, so the size is checked explicitly.
+MAX_IMAGE_PIXELS = 40_000_000
+# Extensions of pre-pipeline uploads, saved as <student_id>.<ext>
+LEGACY_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif')
+
+# Magic bytes -> format name
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+ALLOWED_FORMATS = {'png', 'jpeg', 'gif', 'webp'}
+
+
+class ImageError(ValueError):
+    """ The upload is not an image we accept """
+
+
+class UploadTooLarge(ImageError):
+    """ The upload exceeded the configured size cap """
+
+
+def sniff_format(header):
+    """ Identify an image from its first bytes; returns None if unknown """
+    for signature, name in SIGNATURES:
+        if header.startswith(signature):
+            return name
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def save_upload(stream, path, max_bytes):
+    """ Copy an upload stream to `path`, stopping as soon as it passes `max_bytes`.
+        Returns (format, sha256 hex digest). """
+    digest = hashlib.sha256()
+    written = 0
+    fmt = None
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if written == 0:
+                    fmt = sniff_format(chunk[:16])
+                    if fmt not in ALLOWED_FORMATS:
+                        raise ImageError("File is not a supported image type")
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"File exceeds {max_bytes // (1024 * 1024)} MB limit")
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if written == 0:
+            raise ImageError("Empty file")
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return fmt, digest.hexdigest()
+
+
+def move_into_place(tmp_path, final_path):
+    """ Atomically rename a fully written (fsynced) file and persist the rename """
+    os.replace(tmp_path, final_path)
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(final_path) or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def variant_filename(stem, size, ext):
+    return f"{stem}-{size}.{ext}"
+
+
+def choose_size(requested, sizes=VARIANT_SIZES):
+    """ Smallest variant at least as large as requested (largest if none is) """
+    if not requested:
+        return sizes[-1]
+    for size in sizes:
+        if size >= requested:
+            return size
+    return sizes[-1]
+
+
+def process_image(src_path, out_dir, stem, sizes=VARIANT_SIZES):
+    """ Write every size/format variant of `src_path` into `out_dir`; returns the filenames """
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with Image.open(src_path) as img:
+            if img.width * img.height > MAX_IMAGE_PIXELS:
+                raise ImageError(f"Image is larger than {MAX_IMAGE_PIXELS:,} pixels")
+            img.seek(0) # First frame of animated GIF/WebP
+            img = ImageOps.exif_transpose(img) # Apply orientation before EXIF is dropped
+            img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            if img.mode == 'RGBA':
+                # JPEG has no alpha channel; flatten onto white
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            # Center-crop to a square once, then scale down from the largest size
+            square = ImageOps.fit(img, (max(sizes),) * 2, Image.LANCZOS)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ImageError("Could not decode image") from e
+
+    # On failure only the temp file is removed. Finished variants stay: the stem is
+    # content-hashed, so the same image uploaded earlier may already be live under these names.
+    written = []
+    for size in sorted(sizes, reverse=True):
+        resized = square if size == square.width else square.resize((size, size), Image.LANCZOS)
+        for ext, pil_format in VARIANT_FORMATS.items():
+            filename = variant_filename(stem, size, ext)
+            tmp_path = os.path.join(out_dir, f".{filename}.{secrets.token_hex(4)}.tmp")
+            quality = WEBP_QUALITY if pil_format == 'WEBP' else JPEG_QUALITY
+            try:
+                resized.save(tmp_path, pil_format, quality=quality, optimize=True)
+                os.replace(tmp_path, os.path.join(out_dir, filename))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            written.append(filename)
+    return written
+
+
+def remove_variants(folder, stem, sizes=VARIANT_SIZES):
+    for size in sizes:
+        for ext in VARIANT_FORMATS:
+            try:
+                os.remove(os.path.join(folder, variant_filename(stem, size, ext)))
+            except FileNotFoundError:
+                pass
+
+
+def stem_from_url(profile_pic_url):
+    """ '/profile_pics/<stem>.jpg?size=64' -> '<stem>' """
+    return os.path.splitext(os.path.basename(profile_pic_url.split('?', 1)[0]))[0]
+
+
+def remove_old_pictures(folder, student_id, old_url):
+    """ Delete the files behind a replaced profile_pic_url, plus any legacy <student_id>.<ext>
+        upload. Only known names are touched; the shared folder is never listed. """
+    names = [f"{student_id}.{ext}" for ext in LEGACY_EXTENSIONS]
+    if old_url:
+        stem = stem_from_url(old_url)
+        if stem.startswith(f"{student_id}-"):
+            names += [variant_filename(stem, size, ext) for size in VARIANT_SIZES for ext in VARIANT_FORMATS]
+    for name in names:
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass # Never existed, or another worker already cleaned it up
@@ -0,0 +1,345 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+# --- Request metrics and profiling hooks ---
+# Shared by the profile service and the main app (this module only depends on Flask).
+#
+#   instrumentation = Instrumentation('profile_service')
+#   instrumentation.init_app(app)         # adds GET /metrics
+#   with instrumentation.timed('json_serialize'): ...
+#
+# Metrics are taken around the whole WSGI call, so latency includes streaming
+# the body, and every response is counted, including ones returned early by
+# auth hooks. Exposed at /metrics in the Prometheus text format:
+#   http_request_duration_seconds{endpoint,method}   histogram
+#   http_requests_total{endpoint,method,status}      counter
+#   http_requests_in_flight                          gauge
+#   http_request_bytes_total / http_response_bytes_total {endpoint}
+#   app_phase_duration_seconds{phase}                histogram (template rendering,
+#                                                    upstream calls, serialization, file I/O)
+#
+# Each process keeps its own numbers. With several workers, set METRICS_DIR:
+# every process then writes a snapshot there every few seconds, and /metrics
+# adds them up.
+#
+# Opt-in profiler. Set PROFILER_ENABLED=1. A request is then profiled when:
+#   - it sends "X-Profile: <PROFILER_TOKEN>", or
+#   - it is picked by random sampling (PROFILER_SAMPLE_RATE, e.g. 0.01).
+# A cProfile dump is written to PROFILER_DIR when the request took at least
+# PROFILER_SLOW_MS, or always when the header was sent. View the dump with
+# snakeviz, or turn it into a flamegraph with flameprof.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SNAPSHOT_INTERVAL = 5.0
+
+
+class MetricsRegistry:
+    """ Thread-safe counters, gauges and fixed-bucket histograms keyed by (name, labels) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {} # key -> [bucket counts..., sum, count]
+
+    @staticmethod
+    def key(name, **labels):
+        return json.dumps([name, sorted(labels.items())])
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, **labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        key = self.key(name, **labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, **labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += value
+            hist[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters), 'gauges': dict(self.gauges),
+                    'histograms': {k: list(v) for k, v in self.histograms.items()}}
+
+
+def merge_snapshots(snapshots):
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for snap in snapshots:
+        for kind in ('counters', 'gauges'):
+            for key, value in snap[kind].items():
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        for key, hist in snap['histograms'].items():
+            total = merged['histograms'].setdefault(key, [0] * len(hist))
+            for i, value in enumerate(hist):
+                total[i] += value
+    return merged
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs, extra=()):
+    items = list(pairs) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in items) + '}'
+
+
+def render_prometheus(snapshot, help_text):
+    """ Prometheus text exposition format (version 0.0.4) """
+    series = {}
+    for kind, type_name in (('counters', 'counter'), ('gauges', 'gauge'), ('histograms', 'histogram')):
+        for key, value in snapshot[kind].items():
+            name, labels = json.loads(key)
+            series.setdefault((name, type_name), []).append((labels, value))
+
+    lines = []
+    for (name, type_name), samples in sorted(series.items()):
+        lines.append(f"# HELP {name} {help_text.get(name, name)}")
+        lines.append(f"# TYPE {name} {type_name}")
+        for labels, value in sorted(samples, key=lambda s: s[0]):
+            if type_name != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {value[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {value[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+class Instrumentation:
+    HELP = {
+        'http_request_duration_seconds': "Time from request start until the response body was sent",
+        'http_requests_total': "Requests handled, by status code",
+        'http_requests_in_flight': "Requests currently being handled",
+        'http_request_bytes_total': "Request body bytes received",
+        'http_response_bytes_total': "Response body bytes sent",
+        'app_phase_duration_seconds': "Time spent in a named phase of request handling",
+    }
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.registry = MetricsRegistry()
+        self.metrics_dir = os.environ.get('METRICS_DIR')
+        self.profiler_enabled = os.environ.get('PROFILER_ENABLED', '0') == '1'
+        self.profiler_token = os.environ.get('PROFILER_TOKEN', '')
+        self.profiler_sample_rate = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+        self.profiler_slow_seconds = float(os.environ.get('PROFILER_SLOW_MS', 500)) / 1000
+        self.profiler_dir = os.path.abspath(os.environ.get('PROFILER_DIR', 'profiler_dumps'))
+        # cProfile can only run one profiler at a time per process
+        self._profiler_lock = threading.Lock()
+        self._snapshot_thread = None
+
+    def init_app(self, app, metrics_path='/metrics'):
+        app.wsgi_app = _InstrumentedWSGI(app.wsgi_app, self)
+        app.after_request(self._record_endpoint)
+        app.add_url_rule(metrics_path, 'metrics', self.metrics_view)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        if self.metrics_dir and self._snapshot_thread is None:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            self._snapshot_thread = threading.Thread(target=self._write_snapshots, daemon=True,
+                                                     name='metrics-snapshot')
+            self._snapshot_thread.start()
+
+    # --- Phase timing ---
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registry.observe('app_phase_duration_seconds', time.perf_counter() - start,
+                                  app=self.app_name, phase=phase)
+
+    def _template_started(self, sender, template, context, **extra):
+        g.setdefault('_template_starts', []).append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        starts = g.get('_template_starts')
+        if starts:
+            self.registry.observe('app_phase_duration_seconds', time.perf_counter() - starts.pop(),
+                                  app=self.app_name, phase=f"render:{template.name}")
+
+    @staticmethod
+    def _record_endpoint(response):
+        # Runs for every response, including ones returned early by before_request hooks
+        request.environ['instrumentation.endpoint'] = request.endpoint or 'unmatched'
+        return response
+
+    # --- /metrics ---
+    def metrics_view(self):
+        snapshot = self.registry.snapshot()
+        if self.metrics_dir:
+            snapshot = merge_snapshots([snapshot] + self._other_process_snapshots())
+        return Response(render_prometheus(snapshot, self.HELP),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.metrics_dir, f"{self.app_name}-{pid}.json")
+
+    def _write_snapshots(self):
+        path = self._snapshot_path(os.getpid())
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            tmp_path = f"{path}.tmp"
+            try:
+                os.makedirs(self.metrics_dir, exist_ok=True) # In case it was cleared while running
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.registry.snapshot(), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # Keep trying: a full disk or a missing mount is usually temporary
+                logger.warning("Could not write metrics snapshot %s: %s", path, e)
+
+    def _other_process_snapshots(self):
+        snapshots = []
+        prefix = f"{self.app_name}-"
+        for name in os.listdir(self.metrics_dir):
+            pid = name[len(prefix):-len('.json')]
+            if not (name.startswith(prefix) and name.endswith('.json') and pid.isdigit()):
+                continue # Not a snapshot written by this module
+            pid = int(pid)
+            if pid == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, name)) as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _pid_alive(pid):
+                snap['gauges'] = {} # Counters of exited workers still count; their in-flight gauge doesn't
+            snapshots.append(snap)
+        return snapshots
+
+    # --- Profiler ---
+    def _should_profile(self, environ):
+        if not self.profiler_enabled:
+            return False, False
+        forced = bool(self.profiler_token) and environ.get('HTTP_X_PROFILE') == self.profiler_token
+        sampled = self.profiler_sample_rate > 0 and random.random() < self.profiler_sample_rate
+        return forced or sampled, forced
+
+    def _save_profile(self, profiler, endpoint, elapsed):
+        os.makedirs(self.profiler_dir, exist_ok=True)
+        filename = f"{self.app_name}-{endpoint}-{int(time.time() * 1000)}-{int(elapsed * 1000)}ms.prof"
+        profiler.dump_stats(os.path.join(self.profiler_dir, filename))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _InstrumentedWSGI:
+    """ Times each request from the first call until its response body is closed """
+
+    def __init__(self, wsgi_app, instrumentation):
+        self.wsgi_app = wsgi_app
+        self.inst = instrumentation
+
+    def __call__(self, environ, start_response):
+        inst, registry = self.inst, self.inst.registry
+        start = time.perf_counter()
+        status_holder = []
+
+        def capture_status(status, headers, exc_info=None):
+            status_holder.append(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        profiler = None
+        profile, forced = inst._should_profile(environ)
+        if profile and inst._profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        registry.add_gauge('http_requests_in_flight', 1, app=inst.app_name)
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except BaseException:
+            self._finish(environ, start, '500', 0, profiler, forced)
+            raise
+        return _MeasuredBody(body, lambda sent: self._finish(
+            environ, start, status_holder[0] if status_holder else '500', sent, profiler, forced))
+
+    def _finish(self, environ, start, status, sent, profiler, forced):
+        inst, registry = self.inst, self.inst.registry
+        elapsed = time.perf_counter() - start
+        endpoint = environ.get('instrumentation.endpoint', 'unmatched')
+        method = environ.get('REQUEST_METHOD', '')
+        registry.add_gauge('http_requests_in_flight', -1, app=inst.app_name)
+        registry.observe('http_request_duration_seconds', elapsed,
+                         app=inst.app_name, endpoint=endpoint, method=method)
+        registry.inc('http_requests_total', app=inst.app_name, endpoint=endpoint, method=method, status=status)
+        received = environ.get('CONTENT_LENGTH')
+        if received and received.isdigit():
+            registry.inc('http_request_bytes_total', int(received), app=inst.app_name, endpoint=endpoint)
+        registry.inc('http_response_bytes_total', sent, app=inst.app_name, endpoint=endpoint)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                if forced or elapsed >= inst.profiler_slow_seconds:
+                    inst._save_profile(profiler, endpoint, elapsed)
+            finally:
+                inst._profiler_lock.release()
+
+
+class _MeasuredBody:
+    """ Counts body bytes; reports when the body is exhausted or closed, whichever comes first """
+
+    def __init__(self, body, on_done):
+        self.body = body
+        self.on_done = on_done
+        self.sent = 0
+        self.reported = False
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+        self._report()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._report()
+
+    def _report(self):
+        if not self.reported:
+            self.reported = True
+            self.on_done(self.sent)
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from profile_store import SQLitePool
+
+logger = logging.getLogger(__name__)
+
+# --- Durable background job queue ---
+# Jobs live in SQLite so they survive restarts and can be shared by every
+# worker process. A worker claims a job by taking a time-limited lease; if the
+# worker dies, the lease expires and another worker picks the job up again.
+# Failed attempts are retried with exponential backoff up to max_attempts.
+
+# Shared default for the service and picture_worker.py, independent of their cwd
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+# Longest pause after repeated queue errors (e.g. the database stays locked)
+MAX_ERROR_BACKOFF = 30.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class PermanentJobError(Exception):
+    """ Raised by a job handler when retrying cannot help (e.g. a corrupt image) """
+
+
+class JobQueue:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id           TEXT PRIMARY KEY,
+            kind         TEXT NOT NULL,
+            student_id   TEXT,
+            payload      TEXT NOT NULL,
+            status       TEXT NOT NULL,
+            progress     INTEGER NOT NULL DEFAULT 0,
+            attempts     INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            error        TEXT,
+            result       TEXT,
+            run_after    REAL NOT NULL,
+            lease_until  REAL,
+            created_at   REAL NOT NULL,
+            updated_at   REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after);
+        CREATE INDEX IF NOT EXISTS idx_jobs_student ON jobs(student_id, created_at);
+    """
+    COLUMNS = ('id', 'kind', 'student_id', 'payload', 'status', 'progress', 'attempts',
+               'max_attempts', 'error', 'result', 'run_after', 'lease_until', 'created_at', 'updated_at')
+
+    def __init__(self, path, pool_size=3, lease_seconds=120, max_attempts=5):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._db = SQLitePool(path, pool_size)
+        # Lets workers in this process start on a new job without waiting for the next poll
+        self.wakeup = threading.Event()
+        with self._db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _job(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, kind, payload, student_id=None, job_id=None, delay=0):
+        """ Queue a job to run `delay` seconds from now; returns its id """
+        job_id = job_id or secrets.token_hex(16)
+        now = time.time()
+        with self._db.transaction() as conn:
+            conn.execute("INSERT INTO jobs (id, kind, student_id, payload, status, max_attempts, "
+                         "run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, kind, student_id, json.dumps(payload), QUEUED,
+                          self.max_attempts, now + delay, now, now))
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._db.connection() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self):
+        """ Lease the oldest runnable job (queued, or running with an expired lease) """
+        now = time.time()
+        with self._db.transaction() as conn:
+            # A lease that expired on the last attempt means the job keeps killing its worker
+            # (e.g. an image that exhausts memory); fail it instead of handing it out again.
+            conn.execute("UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+                         "WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                         (FAILED, 'lease expired on final attempt', now, RUNNING, now))
+            row = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs "
+                "WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?) "
+                "ORDER BY run_after LIMIT 1",
+                (QUEUED, now, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row)
+            job['attempts'] += 1
+            job['status'] = RUNNING
+            conn.execute("UPDATE jobs SET status = ?, attempts = ?, lease_until = ?, updated_at = ? "
+                         "WHERE id = ?",
+                         (RUNNING, job['attempts'], now + self.lease_seconds, now, job['id']))
+        return job
+
+    def set_progress(self, job_id, progress):
+        with self._db.transaction() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                         (progress, time.time() + self.lease_seconds, time.time(), job_id))
+
+    def complete(self, job_id, result=None):
+        with self._db.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = ?, progress = 100, result = ?, error = NULL, "
+                         "lease_until = NULL, updated_at = ? WHERE id = ?",
+                         (SUCCEEDED, json.dumps(result), time.time(), job_id))
+
+    def fail(self, job, error, permanent=False):
+        """ Requeue with backoff, or mark failed once attempts run out. Returns the new status. """
+        now = time.time()
+        if permanent or job['attempts'] >= job['max_attempts']:
+            status, run_after = FAILED, now
+        else:
+            status, run_after = QUEUED, now + min(2 ** job['attempts'], 60)
+        with self._db.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, run_after = ?, lease_until = NULL, "
+                         "updated_at = ? WHERE id = ?",
+                         (status, str(error), run_after, now, job['id']))
+        return status
+
+    def close(self):
+        self._db.close()
+
+
+def run_worker(job_queue, handlers, stop_event, poll_interval=1.0):
+    """ Claim and run jobs until stop_event is set. `handlers` maps job kind -> callable(job).
+        Queue errors (locked database, exhausted pool) are logged and retried with backoff;
+        they never end the loop. """
+    errors = 0
+    while not stop_event.is_set():
+        try:
+            job = job_queue.claim()
+            if job is None:
+                job_queue.wakeup.wait(poll_interval)
+                job_queue.wakeup.clear()
+            else:
+                run_job(job_queue, handlers, job)
+            errors = 0
+        except Exception:
+            # A job whose status could not be recorded is picked up again when its lease expires
+            errors += 1
+            logger.exception("Job queue error (%d in a row)", errors)
+            stop_event.wait(min(poll_interval * 2 ** errors, MAX_ERROR_BACKOFF))
+
+
+def run_job(job_queue, handlers, job):
+    handler = handlers.get(job['kind'])
+    try:
+        if handler is None:
+            raise PermanentJobError(f"No handler for job kind '{job['kind']}'")
+        result = handler(job)
+    except PermanentJobError as e:
+        job_queue.fail(job, e, permanent=True)
+        return
+    except Exception as e:
+        logger.exception("Job %s (%s) failed on attempt %d", job['id'], job['kind'], job['attempts'])
+        job_queue.fail(job, e)
+        return
+    job_queue.complete(job['id'], result)
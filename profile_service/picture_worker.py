@@ -0,0 +1,109 @@
+import logging
+import os
+import signal
+import threading
+
+import image_pipeline
+from job_queue import DEFAULT_DB_PATH as DEFAULT_JOB_QUEUE_PATH, JobQueue, PermanentJobError, run_worker
+from profile_store import DEFAULT_STORE_URL, create_store
+
+# --- Background profile picture processing ---
+# The upload endpoint only stores the raw file and queues a 'picture' job.
+# This module turns that raw file into the resized variants and, once they
+# are all on disk, points the student's profile_pic_url at them.
+#
+# Uploads can finish out of order on different workers. The URL is only
+# written if this job was queued after the one that set the current picture
+# (compare-and-set on the stored upload time inside the store transaction).
+# Replaced files are removed by a 'picture_cleanup' job PICTURE_CLEANUP_DELAY
+# seconds later, so pages rendered from cached profiles keep working meanwhile.
+#
+# Workers run as threads inside the service (PICTURE_WORKER_THREADS) and/or
+# as separate processes:  python picture_worker.py
+
+PICTURE_JOB = 'picture'
+CLEANUP_JOB = 'picture_cleanup'
+# Longer than the main app's profile cache TTL plus the time a page stays open
+PICTURE_CLEANUP_DELAY = float(os.environ.get('PICTURE_CLEANUP_DELAY', 300))
+
+
+def make_picture_handler(profile_store, job_queue, upload_folder):
+    def handle(job):
+        payload = job['payload']
+        student_id, raw_path, stem = job['student_id'], payload['raw_path'], payload['stem']
+        last_attempt = job['attempts'] >= job['max_attempts']
+        if not os.path.exists(raw_path):
+            raise PermanentJobError("Uploaded file is missing")
+
+        job_queue.set_progress(job['id'], 10)
+        try:
+            image_pipeline.process_image(raw_path, upload_folder, stem)
+        except image_pipeline.ImageError as e:
+            os.remove(raw_path)
+            raise PermanentJobError(str(e)) from e
+        except Exception:
+            if last_attempt:
+                os.remove(raw_path)
+            raise
+        job_queue.set_progress(job['id'], 80)
+
+        profile_pic_url = f"/profile_pics/{stem}.jpg"
+        outcome = profile_store.set_picture_if_newer(student_id, profile_pic_url, job['created_at'])
+        if outcome is None:
+            os.remove(raw_path)
+            raise PermanentJobError("Student profile no longer exists")
+        updated, previous = outcome
+        if updated:
+            # Retire the replaced picture (and any legacy <student_id>.<ext> upload) once caches have moved on
+            if previous.get('profile_pic_url') != profile_pic_url: # Same image uploaded twice shares the files
+                job_queue.enqueue(CLEANUP_JOB, {"old_url": previous.get('profile_pic_url')},
+                                  student_id=student_id, delay=PICTURE_CLEANUP_DELAY)
+        elif previous.get('profile_pic_url') != profile_pic_url:
+            # A later upload already set its picture; this one was never visible
+            job_queue.enqueue(CLEANUP_JOB, {"old_url": profile_pic_url}, student_id=student_id)
+        os.remove(raw_path)
+        return {"profile_pic_url": profile_pic_url if updated else previous.get('profile_pic_url'),
+                "superseded": not updated}
+    return handle
+
+
+def make_cleanup_handler(profile_store, upload_folder):
+    def handle(job):
+        old_url = job['payload']['old_url']
+        current = (profile_store.get(job['student_id']) or {}).get('profile_pic_url')
+        if old_url and current and image_pipeline.stem_from_url(current) == image_pipeline.stem_from_url(old_url):
+            return {"removed": False} # The same image was uploaded again and is in use
+        image_pipeline.remove_old_pictures(upload_folder, job['student_id'], old_url)
+        return {"removed": True}
+    return handle
+
+
+def make_handlers(profile_store, job_queue, upload_folder):
+    return {PICTURE_JOB: make_picture_handler(profile_store, job_queue, upload_folder),
+            CLEANUP_JOB: make_cleanup_handler(profile_store, upload_folder)}
+
+
+def start_worker_threads(profile_store, job_queue, upload_folder, count):
+    """ Run `count` worker threads in this process; returns (stop event, threads) """
+    stop_event = threading.Event()
+    handlers = make_handlers(profile_store, job_queue, upload_folder)
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=run_worker, args=(job_queue, handlers, stop_event),
+                                  name=f"picture-worker-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return stop_event, threads
+
+
+# --- Standalone worker process ---
+if __name__ == '__main__':
+    store = create_store(os.environ.get('PROFILE_STORE_URL', DEFAULT_STORE_URL))
+    jobs = JobQueue(os.environ.get('JOB_QUEUE_PATH', DEFAULT_JOB_QUEUE_PATH))
+    folder = os.path.abspath(os.environ.get('UPLOAD_FOLDER', 'profile_pics'))
+    stop = threading.Event()
+    # Finish the current job, then exit
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    logging.basicConfig(level=logging.INFO)
+    run_worker(jobs, make_handlers(store, jobs, folder), stop)
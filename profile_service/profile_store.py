@@ -0,0 +1,404 @@
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Storage layer for student profiles ---
+# The service talks to a ProfileStore instead of a module-level dict so that
+# several worker processes can share one copy of the data and nothing is lost
+# on restart. SQLite is the default backend; MemoryProfileStore is kept for
+# quick local experiments.
+# Every write bumps a per-profile version counter and updated_at timestamp,
+# which the service uses for ETag / Last-Modified handling.
+
+
+# Shared default for the service, picture_worker.py and the import CLI, independent of their cwd
+DEFAULT_STORE_URL = f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles.db')}"
+
+
+class ProfileStore:
+    """ Interface every profile backend implements """
+
+    def get(self, student_id):
+        raise NotImplementedError
+
+    def get_record(self, student_id):
+        """ Returns (profile, version, updated_at) or None """
+        raise NotImplementedError
+
+    def get_version(self, student_id):
+        """ Returns (version, updated_at) or None, without loading the profile body """
+        record = self.get_record(student_id)
+        return record[1:] if record else None
+
+    def get_many(self, student_ids):
+        return {sid: self.get(sid) for sid in student_ids}
+
+    def exists(self, student_id):
+        return self.get(student_id) is not None
+
+    def find_by_email(self, email):
+        raise NotImplementedError
+
+    def find_by_program(self, program, limit=100, offset=0):
+        raise NotImplementedError
+
+    def put(self, student_id, profile):
+        raise NotImplementedError
+
+    def update_fields(self, student_id, **fields):
+        """ Merge top-level fields into an existing profile. Returns False if missing. """
+        raise NotImplementedError
+
+    def set_picture_if_newer(self, student_id, profile_pic_url, uploaded_at):
+        """ Atomically set profile_pic_url only if no later upload has set it already.
+            The upload time is kept outside the profile data, so put() and imports keep it.
+            Returns (updated, profile before the call), or None if the profile is missing. """
+        raise NotImplementedError
+
+    def bulk_import(self, profiles, replace=False):
+        """ Load many profiles at once from a {student_id: profile} mapping or (id, profile) pairs """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryProfileStore(ProfileStore):
+    """ Per-process dict backend (not shared between workers) """
+
+    def __init__(self):
+        self._profiles = {}
+        self._versions = {} # student_id -> (version, updated_at)
+        self._pic_uploaded_at = {} # student_id -> upload time of the current picture
+        self._lock = threading.Lock()
+
+    def get(self, student_id):
+        profile = self._profiles.get(student_id)
+        return dict(profile) if profile is not None else None
+
+    def get_record(self, student_id):
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is None:
+                return None
+            return (dict(profile),) + self._versions[student_id]
+
+    def get_version(self, student_id):
+        return self._versions.get(student_id)
+
+    def _bump(self, student_id):
+        version = self._versions.get(student_id, (0, None))[0]
+        self._versions[student_id] = (version + 1, time.time())
+
+    def find_by_email(self, email):
+        for student_id, profile in self._profiles.items():
+            if profile.get('email') == email:
+                return student_id, dict(profile)
+        return None
+
+    def find_by_program(self, program, limit=100, offset=0):
+        matches = sorted(sid for sid, p in self._profiles.items() if p.get('program') == program)
+        return [(sid, dict(self._profiles[sid])) for sid in matches[offset:offset + limit]]
+
+    def put(self, student_id, profile):
+        with self._lock:
+            self._profiles[student_id] = dict(profile)
+            self._bump(student_id)
+
+    def update_fields(self, student_id, **fields):
+        with self._lock:
+            if student_id not in self._profiles:
+                return False
+            self._profiles[student_id].update(fields)
+            self._bump(student_id)
+            return True
+
+    def set_picture_if_newer(self, student_id, profile_pic_url, uploaded_at):
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is None:
+                return None
+            previous = dict(profile)
+            if self._pic_uploaded_at.get(student_id, 0) >= uploaded_at:
+                return False, previous
+            profile['profile_pic_url'] = profile_pic_url
+            self._pic_uploaded_at[student_id] = uploaded_at
+            self._bump(student_id)
+            return True, previous
+
+    def bulk_import(self, profiles, replace=False):
+        items = profiles.items() if isinstance(profiles, dict) else profiles
+        count = 0
+        with self._lock:
+            for student_id, profile in items:
+                if replace or student_id not in self._profiles:
+                    self._profiles[student_id] = dict(profile)
+                    self._bump(student_id)
+                    count += 1
+        return count
+
+
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection frees up within the pool's timeout """
+
+
+class SQLitePool:
+    """ Pool of up to `size` WAL-mode SQLite connections shared by request threads.
+        Connections are opened on first use, so a large size costs nothing until needed. """
+
+    def __init__(self, path, size=5, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        # check_same_thread=False: a pooled connection may be handed to any
+        # request thread, but only one thread holds it at a time.
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No free connection to {self.path} after {self.timeout}s")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class SQLiteProfileStore(ProfileStore):
+    """ SQLite backend with a connection pool and WAL journaling """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS profiles (
+            student_id TEXT PRIMARY KEY,
+            email      TEXT,
+            program    TEXT,
+            data       TEXT NOT NULL,
+            version    INTEGER NOT NULL DEFAULT 1,
+            updated_at REAL NOT NULL DEFAULT 0,
+            pic_uploaded_at REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_profiles_email ON profiles(email);
+        CREATE INDEX IF NOT EXISTS idx_profiles_program ON profiles(program, student_id);
+    """
+    IMPORT_BATCH_SIZE = 1000
+    _INSERT_IGNORE = ("INSERT OR IGNORE INTO profiles (student_id, email, program, data, updated_at) "
+                      "VALUES (?, ?, ?, ?, ?)")
+    # Replacing a profile keeps its version counter moving forward
+    _UPSERT = ("INSERT INTO profiles (student_id, email, program, data, updated_at) "
+               "VALUES (?, ?, ?, ?, ?) "
+               "ON CONFLICT(student_id) DO UPDATE SET email = excluded.email, "
+               "program = excluded.program, data = excluded.data, "
+               "version = profiles.version + 1, updated_at = excluded.updated_at")
+
+    def __init__(self, path, pool_size=5, timeout=5.0):
+        self.path = path
+        self._db = SQLitePool(path, pool_size, timeout)
+        with self._db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        # Databases created before versioning lack these columns
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+        if 'version' not in columns:
+            conn.execute("ALTER TABLE profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        if 'updated_at' not in columns:
+            conn.execute("ALTER TABLE profiles ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        if 'pic_uploaded_at' not in columns:
+            conn.execute("ALTER TABLE profiles ADD COLUMN pic_uploaded_at REAL NOT NULL DEFAULT 0")
+            # Earlier builds kept the upload time inside the profile data
+            conn.execute("UPDATE profiles SET pic_uploaded_at = json_extract(data, '$.profile_pic_uploaded_at'), "
+                         "data = json_remove(data, '$.profile_pic_uploaded_at') "
+                         "WHERE json_extract(data, '$.profile_pic_uploaded_at') IS NOT NULL")
+
+    @staticmethod
+    def _row(student_id, profile):
+        return (student_id, profile.get('email'), profile.get('program'),
+                json.dumps(profile, separators=(',', ':')), time.time())
+
+    def get(self, student_id):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT data FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_record(self, student_id):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT data, version, updated_at FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+        return (json.loads(row[0]), row[1], row[2]) if row else None
+
+    def get_version(self, student_id):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT version, updated_at FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def get_many(self, student_ids):
+        results = dict.fromkeys(student_ids)
+        ids = list(results)
+        with self._db.connection() as conn:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT student_id, data FROM profiles WHERE student_id IN ({placeholders})",
+                    chunk).fetchall()
+                for student_id, data in rows:
+                    results[student_id] = json.loads(data)
+        return results
+
+    def exists(self, student_id):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT 1 FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+        return row is not None
+
+    def find_by_email(self, email):
+        with self._db.connection() as conn:
+            row = conn.execute("SELECT student_id, data FROM profiles WHERE email = ?",
+                               (email,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def find_by_program(self, program, limit=100, offset=0):
+        with self._db.connection() as conn:
+            rows = conn.execute(
+                "SELECT student_id, data FROM profiles WHERE program = ? "
+                "ORDER BY student_id LIMIT ? OFFSET ?",
+                (program, limit, offset)).fetchall()
+        return [(sid, json.loads(data)) for sid, data in rows]
+
+    def put(self, student_id, profile):
+        with self._db.transaction() as conn:
+            conn.execute(self._UPSERT, self._row(student_id, profile))
+
+    def update_fields(self, student_id, **fields):
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT data FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+            if not row:
+                return False
+            profile = json.loads(row[0])
+            profile.update(fields)
+            _, email, program, data, updated_at = self._row(student_id, profile)
+            conn.execute("UPDATE profiles SET email = ?, program = ?, data = ?, "
+                         "version = version + 1, updated_at = ? WHERE student_id = ?",
+                         (email, program, data, updated_at, student_id))
+        return True
+
+    def set_picture_if_newer(self, student_id, profile_pic_url, uploaded_at):
+        # BEGIN IMMEDIATE holds the write lock from the read to the update, across processes
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT data, pic_uploaded_at FROM profiles WHERE student_id = ?",
+                               (student_id,)).fetchone()
+            if not row:
+                return None
+            previous = json.loads(row[0])
+            if row[1] >= uploaded_at:
+                return False, previous
+            profile = dict(previous, profile_pic_url=profile_pic_url)
+            _, email, program, data, updated_at = self._row(student_id, profile)
+            conn.execute("UPDATE profiles SET email = ?, program = ?, data = ?, pic_uploaded_at = ?, "
+                         "version = version + 1, updated_at = ? WHERE student_id = ?",
+                         (email, program, data, uploaded_at, updated_at, student_id))
+        return True, previous
+
+    def bulk_import(self, profiles, replace=False):
+        items = profiles.items() if isinstance(profiles, dict) else profiles
+        sql = self._UPSERT if replace else self._INSERT_IGNORE
+        count = 0
+        batch = []
+        with self._db.connection() as conn:
+            for student_id, profile in items:
+                batch.append(self._row(student_id, profile))
+                if len(batch) >= self.IMPORT_BATCH_SIZE:
+                    count += self._write_batch(conn, sql, batch)
+                    batch = []
+            if batch:
+                count += self._write_batch(conn, sql, batch)
+        return count
+
+    @staticmethod
+    def _write_batch(conn, sql, batch):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(sql, batch)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return conn.total_changes - before
+
+    def close(self):
+        self._db.close()
+
+
+def create_store(url, pool_size=5):
+    """ Build a store from a URL such as 'sqlite:///profiles.db' or 'memory://' """
+    if url.startswith('memory://'):
+        return MemoryProfileStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteProfileStore(url[len('sqlite:///'):], pool_size)
+    raise ValueError(f"Unsupported profile store URL: {url}")
+
+
+def load_profiles_file(path):
+    """ Yield (student_id, profile) pairs from a JSON object file or a JSON Lines file """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.pop('student_id'), record
+        else:
+            yield from json.load(f).items()
+
+
+# --- Bulk import from the command line ---
+# python profile_store.py <profiles.json|profiles.jsonl> [--replace]
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python profile_store.py <profiles.json|profiles.jsonl> [--replace]")
+        sys.exit(1)
+    store = create_store(os.environ.get('PROFILE_STORE_URL', DEFAULT_STORE_URL))
+    imported = store.bulk_import(load_profiles_file(sys.argv[1]), replace='--replace' in sys.argv)
+    print(f"Imported {imported} profiles")
+    store.close()
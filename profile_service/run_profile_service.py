@@ -1,24 +1,65 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+import json
+import math
 import os
+import re
 import secrets # For generating secure random strings (like API keys)
+import threading
+import image_pipeline
+from api_keys import DEFAULT_DB_PATH as DEFAULT_API_KEY_DB_PATH, ApiKeyStore
+from instrumentation import Instrumentation
+from job_queue import DEFAULT_DB_PATH as DEFAULT_JOB_QUEUE_PATH, JobQueue
+from picture_worker import PICTURE_JOB, start_worker_threads
+from profile_store import DEFAULT_STORE_URL, PoolTimeout, create_store
 
 app = Flask(__name__)
+# Request metrics at /metrics and the opt-in profiler (see instrumentation.py for the env vars)
+instrumentation = Instrumentation('profile_service')
+instrumentation.init_app(app)
 
 # --- Configuration ---
 # In a real app, use environment variables or a config file
-UPLOAD_FOLDER = 'profile_pics'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Absolute, because send_from_directory resolves relative paths against the app root, not the cwd
+UPLOAD_FOLDER = os.path.abspath(os.environ.get('UPLOAD_FOLDER', 'profile_pics'))
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# This is a placeholder. In a real app, store keys securely and validate properly.
-VALID_API_KEYS = {"your_main_app_key_here": "MainApp"} # Simulate API key validation
+# Raw uploads wait here until a picture job has processed them. Absolute, because the
+# path is stored in the job and may be read by a worker process started elsewhere
+INCOMING_FOLDER = os.path.abspath(os.environ.get('INCOMING_FOLDER', 'incoming_pics'))
+# Background picture processing: SQLite job queue file and in-process worker threads
+# (set PICTURE_WORKER_THREADS=0 when running picture_worker.py processes instead)
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', DEFAULT_JOB_QUEUE_PATH)
+PICTURE_WORKER_THREADS = int(os.environ.get('PICTURE_WORKER_THREADS', 2))
+# Largest picture upload accepted; Werkzeug rejects bigger request bodies up front
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 8 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024 # Room for multipart headers
+# Profile storage backend: 'sqlite:///<path>' (default: profiles.db next to profile_store.py) or 'memory://'
+PROFILE_STORE_URL = os.environ.get('PROFILE_STORE_URL', DEFAULT_STORE_URL)
+# API keys (hashed) and their shared rate-limit buckets; manage keys with main_app/API_KEY_GEN.py
+API_KEY_DB_PATH = os.environ.get('API_KEY_DB_PATH', DEFAULT_API_KEY_DB_PATH)
+REQUIRE_API_KEY = os.environ.get('REQUIRE_API_KEY', '1') != '0'
+# Connections per SQLite pool (profiles, API keys, jobs), opened on demand. Default: one per
+# request thread (WEB_THREADS in asgi.py) and picture worker, so requests never queue for one
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE',
+                                  int(os.environ.get('WEB_THREADS', 32)) + PICTURE_WORKER_THREADS))
+# Endpoints reachable without a key (pictures are loaded directly by browsers).
+# Keep /metrics off the public network at the load balancer.
+PUBLIC_ENDPOINTS = {'get_profile_pic', 'static', 'healthz', 'readyz', 'metrics'}
+# Profile JSON must be revalidated (cheap 304s); hashed picture URLs never change
+PROFILE_CACHE_CONTROL = 'private, no-cache'
+PICTURE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Batch fetch limits: max IDs per request, and how many are read from the store per chunk
+MAX_BATCH_IDS = 5000
+BATCH_CHUNK_SIZE = 500
 
-# --- Ensure upload directory exists ---
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# --- Ensure upload directories exist ---
+for folder in (UPLOAD_FOLDER, INCOMING_FOLDER):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
 
-# --- Sample Data (Replace with Database) ---
+# --- Sample Data ---
+# Seeded into the profile store on startup; existing records are left untouched.
 # Using student_id as the key
-student_profiles = {
+SAMPLE_PROFILES = {
     "s12345678": {
         "first_name": "Jane",
         "middle_name": "",
@@ -42,37 +83,205 @@ student_profiles = {
     # Add more student profiles as needed
 }
 
+# --- Profile Store ---
+# Shared by every worker process that points at the same database file
+profile_store = create_store(PROFILE_STORE_URL, DB_POOL_SIZE)
+profile_store.bulk_import(SAMPLE_PROFILES)
+
+# --- API Keys ---
+api_key_store = ApiKeyStore(API_KEY_DB_PATH, DB_POOL_SIZE)
+
+# --- Picture Jobs ---
+job_queue = JobQueue(JOB_QUEUE_PATH, DB_POOL_SIZE)
+stop_picture_workers, picture_worker_threads = start_worker_threads(
+    profile_store, job_queue, UPLOAD_FOLDER, PICTURE_WORKER_THREADS)
+
+# --- Lifecycle ---
+# Set by startup() once the databases answer; cleared as soon as the process starts draining
+service_ready = threading.Event()
+
+def startup():
+    """ Check that the databases answer, then report ready. Called by the
+        ASGI lifespan in asgi.py, or before app.run() for the development server. """
+    profile_store.exists('')
+    job_queue.get('')
+    service_ready.set()
+
+def shutdown(timeout=30):
+    """ Stop taking traffic, let picture workers finish their current job, close the databases.
+        Call it only after in-flight requests are done; it closes the stores they use. """
+    service_ready.clear()
+    stop_picture_workers.set()
+    job_queue.wakeup.set()
+    for thread in picture_worker_threads:
+        thread.join(timeout)
+    job_queue.close()
+    api_key_store.close()
+    profile_store.close()
+
 # --- Helper Functions ---
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def parse_fields(fields):
+    """ Turn 'a,b,c' (or a list) into a set of field names; None means all fields.
+        Raises ValueError for anything else. """
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    elif not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+        raise ValueError("'fields' must be a comma-separated string or a list of field names")
+    return {f.strip() for f in fields if f.strip()}
 
-def authenticate_request():
-    """ Placeholder for API Key Authentication """
-    api_key = request.headers.get('X-API-Key')
-    if api_key and api_key in VALID_API_KEYS:
-        return True
+def project_profile(profile, fields):
+    if fields is None:
+        return profile
+    return {k: v for k, v in profile.items() if k in fields}
+
+def profile_etag(version, updated_at):
+    """ Strong ETag derived from the store's version counter """
+    return f"{version}-{int(updated_at * 1000):x}"
+
+def not_modified(etag, updated_at):
+    """ True if the client's conditional headers show it already has this version """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and updated_at:
+        return int(updated_at) <= request.if_modified_since.timestamp()
     return False
 
+# Content-hashed picture names: <student_id>-<sha256 prefix>[-<size>].<ext>
+HASHED_PIC_RE = re.compile(r'^(?P<stem>[^/]+-[0-9a-f]{16})(?:-(?P<size>\d+))?\.(?P<ext>[a-z0-9]+)$')
+
+def send_picture(filename):
+    # Opening and stat-ing the file; the body itself is streamed by the server
+    with instrumentation.timed('send_file'):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+def requested_size():
+    """ ?size=<px>, or None if missing or not a number """
+    size = request.args.get('size', '')
+    return int(size) if size.isdigit() else None
+
+def preferred_picture_ext():
+    """ WebP for clients that advertise it, JPEG otherwise """
+    return 'webp' if request.accept_mimetypes['image/webp'] else 'jpg'
+
+# --- Authentication ---
+@app.before_request
+def authenticate_request():
+    """ Require a valid X-API-Key on every non-public endpoint and apply its rate limit """
+    if not REQUIRE_API_KEY or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    key = api_key_store.verify(request.headers.get('X-API-Key'))
+    if key is None:
+        return jsonify({"error": "Unauthorized"}), 401
+    if not api_key_store.allow(key):
+        response = jsonify({"error": "Rate limit exceeded"})
+        response.status_code = 429
+        # Keys issued before rates were validated may have rate 0
+        response.headers['Retry-After'] = str(math.ceil(1 / key['rate']) if key['rate'] > 0 else 60)
+        return response
+    g.api_client = key['name']
+    return None
+
+# --- Error Handlers ---
+@app.errorhandler(PoolTimeout)
+def database_busy(e):
+    # Every pooled connection stayed busy past the pool timeout: overloaded, not broken
+    response = jsonify({"error": "Service busy, try again shortly"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 # --- API Endpoints ---
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: startup finished, not draining, and the databases answer
+    if not service_ready.is_set():
+        return jsonify({"status": "not ready"}), 503
+    try:
+        profile_store.exists('')
+        job_queue.get('')
+    except Exception as e:
+         # Log the error e
+        return jsonify({"status": "unavailable"}), 503
+    return jsonify({"status": "ready"})
+
 @app.route('/profile/<student_id>', methods=['GET'])
 def get_profile(student_id):
-    # --- Authentication ---
-    # if not authenticate_request():
-    #     return jsonify({"error": "Unauthorized"}), 401
-
-    profile = student_profiles.get(student_id)
-    if not profile:
+    # Answer conditional requests from the version counter alone, before
+    # the profile body is loaded or serialized
+    with instrumentation.timed('store_lookup'):
+        version = profile_store.get_version(student_id)
+    if version is None:
         return jsonify({"error": "Student profile not found"}), 404
-    return jsonify(profile)
+    etag = profile_etag(*version)
+    if not_modified(etag, version[1]):
+        response = app.response_class(status=304)
+    else:
+        with instrumentation.timed('store_lookup'):
+            record = profile_store.get_record(student_id)
+        if record is None:
+            return jsonify({"error": "Student profile not found"}), 404
+        profile, *version = record
+        etag = profile_etag(*version)
+        with instrumentation.timed('json_serialize'):
+            response = jsonify(profile)
+        response.last_modified = version[1]
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = PROFILE_CACHE_CONTROL
+    return response
+
+@app.route('/profiles:batch', methods=['POST'])
+def get_profiles_batch():
+    # Body: {"ids": ["s1", "s2", ...], "fields": "first_name,last_name"}
+    # fields may also be passed as ?fields=... on the query string
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    ids = payload.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return jsonify({"error": "'ids' must be a list of student IDs"}), 400
+    ids = list(dict.fromkeys(ids)) # Drop duplicates, keep order
+    if len(ids) > MAX_BATCH_IDS:
+        return jsonify({"error": f"Too many IDs (max {MAX_BATCH_IDS})"}), 400
+    try:
+        fields = parse_fields(request.args.get('fields') or payload.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        # Streams {"results": [...], "missing": [...]} one chunk of IDs at a time,
+        # so large batches never hold every serialized profile in memory at once
+        # (one write per chunk; a write per item means hundreds of tiny socket sends)
+        missing = []
+        separator = ''
+        yield '{"results":['
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + BATCH_CHUNK_SIZE]
+            profiles = profile_store.get_many(chunk)
+            items = []
+            for student_id in chunk:
+                profile = profiles.get(student_id)
+                if profile is None:
+                    missing.append(student_id)
+                    item = {"student_id": student_id, "error": "Student profile not found"}
+                else:
+                    item = {"student_id": student_id, "profile": project_profile(profile, fields)}
+                items.append(json.dumps(item, separators=(',', ':')))
+            yield separator + ','.join(items)
+            separator = ','
+        yield '],"missing":' + json.dumps(missing) + '}'
+
+    return Response(generate(), mimetype='application/json')
 
 @app.route('/profile/<student_id>/picture', methods=['POST'])
 def upload_profile_picture(student_id):
-    # --- Authentication ---
-    # if not authenticate_request():
-    #     return jsonify({"error": "Unauthorized"}), 401
-
-    if student_id not in student_profiles:
+    if not profile_store.exists(student_id):
         return jsonify({"error": "Student profile not found"}), 404
 
     if 'photo' not in request.files:
@@ -81,36 +290,72 @@ def upload_profile_picture(student_id):
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if file and allowed_file(file.filename):
-        # Secure filename and create a unique name to avoid conflicts
-        # Using student_id ensures each student has one picture, overwriting previous
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{student_id}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        try:
-            # --- (Optional) Delete old picture if exists with different extension ---
-            # You might want to find and delete any existing file for this student_id
-            # e.g., if they upload a .png replacing a .jpg
-            # ---
-            file.save(filepath)
-            # Update the profile data with the new URL (relative path for simplicity)
-            profile_pic_url = f"/profile_pics/{filename}" # URL path served by get_profile_pic
-            student_profiles[student_id]['profile_pic_url'] = profile_pic_url
-            return jsonify({"message": "Profile picture updated successfully", "profile_pic_url": profile_pic_url}), 200
-        except Exception as e:
-             # Log the error e
-            return jsonify({"error": "Could not save file"}), 500
-    else:
-        return jsonify({"error": "File type not allowed"}), 400
+    job_id = secrets.token_hex(16)
+    tmp_path = os.path.join(INCOMING_FOLDER, f".{job_id}.tmp")
+    try:
+        # Copy in chunks, checking the size cap and the real format (magic bytes) as we go
+        fmt, digest = image_pipeline.save_upload(file.stream, tmp_path, MAX_UPLOAD_BYTES)
+        raw_path = os.path.join(INCOMING_FOLDER, f"{job_id}.{fmt}")
+        image_pipeline.move_into_place(tmp_path, raw_path)
+    except image_pipeline.UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except image_pipeline.ImageError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+         # Log the error e
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return jsonify({"error": "Could not save file"}), 500
+
+    # Resizing happens on a picture worker; profile_pic_url switches over when it finishes.
+    # Name the files after their content so the URLs can be cached forever
+    stem = f"{student_id}-{digest[:16]}"
+    job_queue.enqueue(PICTURE_JOB, {"raw_path": raw_path, "stem": stem},
+                      student_id=student_id, job_id=job_id)
+    response = jsonify({"message": "Profile picture accepted for processing", "job_id": job_id,
+                        "status_url": f"/jobs/{job_id}"})
+    response.status_code = 202
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({
+        "job_id": job['id'],
+        "student_id": job['student_id'],
+        "status": job['status'],
+        "progress": job['progress'],
+        "attempts": job['attempts'],
+        "error": job['error'],
+        "result": job['result'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+    })
 
 @app.route('/profile_pics/<filename>')
 def get_profile_pic(filename):
      # Serves the uploaded pictures
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+     # /profile_pics/<stem>.jpg?size=64 picks the nearest variant; the format follows Accept
+    match = HASHED_PIC_RE.match(filename)
+    if not match:
+        return send_picture(filename)
+    if match.group('size'):
+        # An exact variant was requested by name
+        response = send_picture(filename)
+    else:
+        size = image_pipeline.choose_size(requested_size())
+        variant = image_pipeline.variant_filename(match.group('stem'), size, preferred_picture_ext())
+        response = send_picture(variant)
+        response.vary.add('Accept')
+    response.headers['Cache-Control'] = PICTURE_CACHE_CONTROL
+    return response
 
 # --- Running the App ---
 if __name__ == '__main__':
     # Use host='0.0.0.0' to make it accessible on your network
-    # Use a proper WSGI server like Gunicorn in production
+    # Development server only; run serve.py in production
+    startup()
     app.run(debug=True, port=5001) # Run on a different port than main app
\ No newline at end of file
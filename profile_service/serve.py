@@ -0,0 +1,41 @@
+import os
+
+import uvicorn
+
+# --- Production server ---
+# python serve.py
+#
+# Runs the profile service (asgi.py) under uvicorn. Settings come from the environment:
+#   HOST / PORT           listen address (default 127.0.0.1:5001)
+#   WEB_WORKERS           processes (default: CPU count); they share the SQLite files
+#   WEB_THREADS           request threads per process (read by asgi.py, default 32)
+#   DB_POOL_SIZE          SQLite connections per database per process (default WEB_THREADS +
+#                         PICTURE_WORKER_THREADS); a request that waits 5s for one gets a 503
+#   WEB_MAX_CONCURRENCY   open connections + requests per process before answering 503
+#   WEB_KEEPALIVE         idle keep-alive timeout in seconds
+#   DRAIN_SECONDS         on SIGTERM, seconds /readyz reports 503 while still serving (default 5)
+#   GRACEFUL_TIMEOUT      seconds to finish in-flight requests and picture jobs on SIGTERM
+#   METRICS_DIR           shared directory so /metrics adds up all workers (clear it on deploy)
+#   PROFILER_*            opt-in cProfile dumps for slow requests, see instrumentation.py
+#
+# Point load balancer health checks at /readyz; it returns 503 while starting or draining.
+# Allow DRAIN_SECONDS + GRACEFUL_TIMEOUT before the process is killed (e.g. the pod's
+# terminationGracePeriodSeconds).
+
+def main():
+    uvicorn.run(
+        'asgi:application',
+        host=os.environ.get('HOST', '127.0.0.1'),
+        port=int(os.environ.get('PORT', 5001)),
+        workers=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)),
+        limit_concurrency=int(os.environ.get('WEB_MAX_CONCURRENCY', 1000)),
+        backlog=int(os.environ.get('WEB_BACKLOG', 2048)),
+        timeout_keep_alive=int(os.environ.get('WEB_KEEPALIVE', 5)),
+        timeout_graceful_shutdown=int(float(os.environ.get('GRACEFUL_TIMEOUT', 30))),
+        lifespan='on',
+        access_log=os.environ.get('ACCESS_LOG', '0') == '1',
+    )
+
+
+if __name__ == '__main__':
+    main()